@@ -0,0 +1,24 @@
+# app/clients.py
+import os
+
+import httpx
+from agents import set_default_openai_client
+from dotenv import load_dotenv
+from openai import AsyncOpenAI
+
+load_dotenv()
+
+# One OpenAI client, and so one connection pool, for the whole app.
+# The default pool (10 connections, HTTP/1.1) starves when agent runs, titling,
+# transcription and uploads overlap across users; HTTP/2 multiplexes them over fewer
+# TLS connections. The read timeout matches the OpenAI default since agent streams
+# can stay quiet for a long time while the model reasons.
+http_client = httpx.AsyncClient(
+    http2=True,
+    limits=httpx.Limits(max_connections=200, max_keepalive_connections=100),
+    timeout=httpx.Timeout(600.0, connect=5.0),
+)
+client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"), http_client=http_client)
+
+# Agent runs go through the same client instead of the Agents SDK building its own
+set_default_openai_client(client)
@@ -1,17 +1,21 @@
-import io
-import base64
+import pybase64 as base64
 import asyncio
 import json
+import hashlib
+import logging
+from collections import OrderedDict
+from contextvars import ContextVar
+from dataclasses import replace
+from functools import lru_cache
 from pathlib import Path
-from typing import AsyncIterator, Any, List
+from typing import AsyncIterator, Any, List, Sequence
 from datetime import datetime
-from openai import AsyncOpenAI
 from openai.types.responses import ResponseInputTextParam, ResponseInputImageParam
-import os
 
 from chatkit.server import ChatKitServer
 from chatkit.types import (
     ThreadMetadata,
+    ThreadItem,
     UserMessageItem,
     ThreadStreamEvent,
     AssistantMessageItem,
@@ -26,6 +30,7 @@ from chatkit.types import (
     UserMessageTextContent,
     ProgressUpdateEvent,
     ClientEffectEvent,
+    SDKHiddenContextItem,
     Annotation,
     URLSource,
 )
@@ -35,20 +40,128 @@ from chatkit.agents import (
     ThreadItemConverter,
     ResponseStreamConverter,
 )
-from agents import Runner
+from agents import Agent, Runner
 
+from .clients import client
+from .store import SQLiteStore
 from .types import RequestContext
 from .agent import my_agent
 from .tools import MOCK_ENTITIES 
 
-from dotenv import load_dotenv
-load_dotenv()
+logger = logging.getLogger(__name__)
 
-client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 UPLOAD_DIR = Path("uploads")
+TITLE_HEURISTIC_MAX_CHARS = 160
+TITLE_MAX_CHARS = 40
+
+# The transcription API infers the audio format from the file name
+AUDIO_EXTENSIONS = {
+    "audio/webm": "webm",
+    "audio/ogg": "ogg",
+    "audio/mp4": "mp4",
+    "audio/mpeg": "mp3",
+    "audio/wav": "wav",
+    "audio/x-wav": "wav",
+}
+
+# In-flight title generation, keyed by thread id
+_TITLE_TASKS: dict[str, asyncio.Task] = {}
+
+
+def is_image(content_type: str | None) -> bool:
+    # Slice compare instead of startswith; also tolerates uploads sent without a type
+    return content_type is not None and content_type[:6] == "image/"
+
+
+def _attachment_path(attachment) -> Path:
+    """
+    Resolves the uploaded file directly instead of scanning UPLOAD_DIR.
+    main.py records the stored filename in the attachment metadata; older attachments
+    were saved as `<id><suffix of the original name>`, so fall back to that.
+    """
+    filename = (attachment.metadata or {}).get("filename")
+    return UPLOAD_DIR / (filename or f"{attachment.id}{Path(attachment.name).suffix}")
+
+
+def _encode_data_url(file_path: Path, mime_type: str) -> str:
+    b64 = base64.b64encode(file_path.read_bytes()).decode("ascii")
+    return "".join(("data:", mime_type, ";base64,", b64))
+
+
+class StringLRUCache:
+    """LRU of strings (data URLs, titles), bounded by entry count and total size."""
+
+    def __init__(self, max_entries: int = 128, max_chars: int = 64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_chars = max_chars
+        self._entries: OrderedDict[str, str] = OrderedDict()
+        self._chars = 0
+
+    def get(self, key: str) -> str | None:
+        url = self._entries.get(key)
+        if url is not None:
+            self._entries.move_to_end(key)
+        return url
+
+    def put(self, key: str, url: str) -> None:
+        if len(url) > self.max_chars:
+            return
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self._chars -= len(previous)
+        self._entries[key] = url
+        self._chars += len(url)
+        while len(self._entries) > self.max_entries or self._chars > self.max_chars:
+            _, evicted = self._entries.popitem(last=False)
+            self._chars -= len(evicted)
+
+
+_DATA_URL_CACHE = StringLRUCache()
+# Titles are deterministic (temperature=0), so identical first messages can share one
+_TITLE_CACHE = StringLRUCache(max_entries=1024)
+
+
+async def _summarize_title(text: str) -> str:
+    """
+    Streams a short title from the model and stops at the first line break or once
+    TITLE_MAX_CHARS have arrived, instead of waiting for the whole completion.
+    """
+    stream = await client.chat.completions.create(
+        model="gpt-4o-mini",
+        messages=[
+            {
+                "role": "system",
+                "content": "Summarize this message into a 3-word title. Return only the title text.",
+            },
+            {"role": "user", "content": text},
+        ],
+        stream=True,
+        max_tokens=8,
+        temperature=0,
+    )
+    title = ""
+    try:
+        async for chunk in stream:
+            if chunk.choices:
+                title += chunk.choices[0].delta.content or ""
+            if "\n" in title or len(title) >= TITLE_MAX_CHARS:
+                break
+    finally:
+        await stream.close()
+    return title.split("\n", 1)[0].strip().replace('"', "")[:TITLE_MAX_CHARS]
+
+
+# Attachment contents resolved up front by LocalConverter.to_agent_input, keyed by
+# attachment id. Request-scoped via ContextVar since the converter itself is shared.
+_PREFETCHED_ATTACHMENTS: ContextVar[dict[str, Any]] = ContextVar(
+    "prefetched_attachments", default={}
+)
 
 
 class LocalConverter(ThreadItemConverter):
+    def __init__(self, store: SQLiteStore):
+        self.store = store
+
     async def tag_to_message_content(
         self, tag: UserMessageTagContent
     ) -> ResponseInputTextParam:
@@ -79,25 +192,75 @@ class LocalConverter(ThreadItemConverter):
             type="input_text", text=f"\n[User tagged: {tag.text}]\n"
         )
 
-    async def attachment_to_message_content(self, attachment):
-        file_path = next(
-            (f for f in UPLOAD_DIR.iterdir() if f.stem == attachment.id), None
+    async def to_agent_input(self, thread_items: Sequence[ThreadItem] | ThreadItem):
+        """
+        Resolves every attachment in the history concurrently before the base class
+        walks the items one by one, so N files cost one round of I/O instead of N.
+        """
+        items = thread_items if isinstance(thread_items, Sequence) else [thread_items]
+        attachments = {
+            a.id: a
+            for item in items
+            if isinstance(item, UserMessageItem)
+            for a in item.attachments
+        }
+        # Files API ids are looked up now rather than read from the item's attachment
+        # snapshot: the upload finishes in the background, possibly after the message was sent
+        openai_file_ids = await self.store.find_openai_file_ids([
+            filename
+            for a in attachments.values()
+            if is_image(a.mime_type) and (filename := (a.metadata or {}).get("filename"))
+        ])
+        contents = await asyncio.gather(
+            *(
+                self._attachment_content(
+                    a, openai_file_ids.get((a.metadata or {}).get("filename"))
+                )
+                for a in attachments.values()
+            )
         )
-        if not file_path:
-            return ResponseInputTextParam(type="input_text", text="[File not found]")
+        token = _PREFETCHED_ATTACHMENTS.set(dict(zip(attachments, contents)))
+        try:
+            return await super().to_agent_input(thread_items)
+        finally:
+            _PREFETCHED_ATTACHMENTS.reset(token)
 
-        with open(file_path, "rb") as f:
-            file_bytes = f.read()
+    async def attachment_to_message_content(self, attachment):
+        prefetched = _PREFETCHED_ATTACHMENTS.get().get(attachment.id)
+        if prefetched is not None:
+            return prefetched
+        return await self._attachment_content(attachment)
+
+    async def _attachment_content(self, attachment, openai_file_id: str | None = None):
+        # Images already uploaded to the Files API are referenced by id, no base64 needed
+        if openai_file_id:
+            return ResponseInputImageParam(
+                type="input_image", detail="auto", file_id=openai_file_id
+            )
 
-        if isinstance(attachment, ImageAttachment) or attachment.mime_type.startswith(
-            "image/"
-        ):
-            b64 = base64.b64encode(file_bytes).decode("utf-8")
+        file_path = _attachment_path(attachment)
+        # File I/O runs off the event loop so large files don't stall other streams
+        try:
+            stat = await asyncio.to_thread(file_path.stat)
+        except FileNotFoundError:
+            return ResponseInputTextParam(type="input_text", text="[File not found]")
+
+        if isinstance(attachment, ImageAttachment) or is_image(attachment.mime_type):
+            # The same image is re-sent on every turn; encode it once per file version
+            cache_key = f"{attachment.id}:{stat.st_mtime_ns}:{stat.st_size}"
+            image_url = _DATA_URL_CACHE.get(cache_key)
+            if image_url is None:
+                image_url = await asyncio.to_thread(
+                    _encode_data_url, file_path, attachment.mime_type
+                )
+                _DATA_URL_CACHE.put(cache_key, image_url)
             return ResponseInputImageParam(
                 type="input_image",
                 detail="auto",
-                image_url=f"data:{attachment.mime_type};base64,{b64}",
+                image_url=image_url,
             )
+
+        file_bytes = await asyncio.to_thread(file_path.read_bytes)
         try:
             return ResponseInputTextParam(
                 type="input_text",
@@ -129,7 +292,28 @@ class LocalResponseConverter(ResponseStreamConverter):
         )
 
 
+@lru_cache(maxsize=8)
+def _agent_for(model: str | None, tool_choice: str | None) -> Agent:
+    """Returns my_agent with the requested overrides, cloning once per combination."""
+    if not model and not tool_choice:
+        return my_agent
+    overrides: dict[str, Any] = {}
+    if model:
+        overrides["model"] = model
+    if tool_choice:
+        overrides["model_settings"] = replace(my_agent.model_settings, tool_choice=tool_choice)
+    return my_agent.clone(**overrides)
+
+
+# The response converter is stateless, so every request shares one instance
+LOCAL_RESPONSE_CONVERTER = LocalResponseConverter(partial_images=3)
+
+
 class MyChatKitServer(ChatKitServer[RequestContext]):
+    def __init__(self, store: SQLiteStore, attachment_store: SQLiteStore | None = None):
+        super().__init__(store, attachment_store)
+        # Shared across requests; it reads Files API ids from the store
+        self.converter = LocalConverter(store)
 
     async def respond(
         self,
@@ -138,45 +322,67 @@ class MyChatKitServer(ChatKitServer[RequestContext]):
         context: RequestContext,
     ) -> AsyncIterator[ThreadStreamEvent]:
 
-        items_page = await self.store.load_thread_items(
-            thread.id, None, 20, "desc", context
-        )
-        items = list(reversed(items_page.data))
+        # Auto-title generation for new threads. Only the incoming message is needed,
+        # so start it before the history load instead of after it.
+        if thread.title is None and input_message:
+            self._schedule_thread_title(thread, input_message, context)
 
-        # Auto-title generation for new threads
-        if len(items) <= 1 and input_message:
-            asyncio.create_task(self._generate_thread_title(thread, items, context))
+        items = await self.store.load_recent_thread_items(thread.id, 20, context)
 
         agent_context = AgentContext(
             thread=thread, store=self.store, request_context=context
         )
 
-        converter = LocalConverter()
-        agent_inputs = await converter.to_agent_input(items)
+        agent_inputs = await self.converter.to_agent_input(items)
 
 
+        active_agent = my_agent
         if input_message and input_message.inference_options:
-            # 1. Handle Model Switching
-            if input_message.inference_options.model:
-                my_agent.model = input_message.inference_options.model
-
-            # 2. Handle Tool Forcing
-            if input_message.inference_options.tool_choice:
-                tool_id = input_message.inference_options.tool_choice.id
-                my_agent.model_settings.tool_choice = tool_id
+            options = input_message.inference_options
+            # Model switching / tool forcing use a per-request clone; mutating the
+            # shared my_agent would leak one user's choice into everyone's requests
+            active_agent = _agent_for(
+                options.model, options.tool_choice.id if options.tool_choice else None
+            )
 
         # Pass run_kwargs to the runner
         result = Runner.run_streamed(
-            my_agent, 
+            active_agent, 
             agent_inputs, 
             context=agent_context,
         )
 
         async for event in stream_agent_response(
-            agent_context, result, converter=LocalResponseConverter(partial_images=3)
+            agent_context, result, converter=LOCAL_RESPONSE_CONVERTER
         ):
             yield event
 
+    async def handle_stream_cancelled(
+        self,
+        thread: ThreadMetadata,
+        pending_items: List[ThreadItem],
+        context: RequestContext,
+    ):
+        """
+        Same behaviour as the default implementation (keep non-empty partial assistant
+        messages, then mark the cancellation), but written in a single transaction.
+        """
+        items: List[ThreadItem] = [
+            item
+            for item in pending_items
+            if isinstance(item, AssistantMessageItem)
+            and any(part.text.strip() for part in item.content)
+        ]
+        items.append(
+            SDKHiddenContextItem(
+                thread_id=thread.id,
+                created_at=datetime.now(),
+                id=self.store.generate_item_id("sdk_hidden_context", thread, context),
+                content="The user cancelled the stream. Stop responding to the prior request.",
+            )
+        )
+        await self.store.add_thread_items(thread.id, items, context)
+
     async def action(
         self,
         thread: ThreadMetadata,
@@ -217,42 +423,50 @@ class MyChatKitServer(ChatKitServer[RequestContext]):
                 )
             )
 
+    def _schedule_thread_title(
+        self, thread: ThreadMetadata, message: UserMessageItem, context: RequestContext
+    ):
+        # One titling task per thread; also keeps a reference so the task isn't GC'd mid-flight
+        if thread.id in _TITLE_TASKS:
+            return
+        first_text = next(
+            (part.text for part in message.content if isinstance(part, UserMessageTextContent)),
+            None,
+        )
+        task = asyncio.create_task(self._generate_thread_title(thread, first_text, context))
+        _TITLE_TASKS[thread.id] = task
+        task.add_done_callback(lambda _: _TITLE_TASKS.pop(thread.id, None))
+
     async def _generate_thread_title(
-        self, thread: ThreadMetadata, items: List[Any], context: RequestContext
+        self, thread: ThreadMetadata, first_text: str | None, context: RequestContext
     ):
         try:
-            first_text = "New Conversation"
-            for item in items:
-                if isinstance(item, UserMessageItem):
-                    for part in item.content:
-                        if isinstance(part, UserMessageTextContent):
-                            first_text = part.text
-                            break
-                    break
-
-            res = await client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "Summarize this message into a 3-word title. Return only the title text.",
-                    },
-                    {"role": "user", "content": first_text},
-                ],
-            )
-            new_title = res.choices[0].message.content.strip().replace('"', "")
+            # Short messages make a fine title as-is; only summarize long ones with the model
+            if first_text and len(first_text) < TITLE_HEURISTIC_MAX_CHARS:
+                thread.title = " ".join(first_text.split()[:5])[:TITLE_MAX_CHARS]
+                await self.store.save_thread(thread, context)
+                return
+
+            prompt = first_text or "New Conversation"
+            cache_key = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+            new_title = _TITLE_CACHE.get(cache_key)
+            if new_title is None:
+                new_title = await _summarize_title(prompt)
+                _TITLE_CACHE.put(cache_key, new_title)
 
             thread.title = new_title
             await self.store.save_thread(thread, context)
-        except Exception as e:
-            print(f"Titling error: {e}")
+        except Exception:
+            logger.exception("Titling error")
 
     async def transcribe(
         self, audio_input: AudioInput, context: RequestContext
     ) -> TranscriptionResult:
-        f = io.BytesIO(audio_input.data)
-        f.name = "voice.webm"
+        # (filename, bytes, content type) is sent as-is, no BytesIO copy of the recording
+        media_type = audio_input.media_type
+        ext = AUDIO_EXTENSIONS.get(media_type, "webm")
         transcription = await client.audio.transcriptions.create(
-            model="gpt-4o-mini-transcribe", file=f
+            model="gpt-4o-mini-transcribe",
+            file=(f"voice.{ext}", audio_input.data, media_type),
         )
         return TranscriptionResult(text=transcription.text)
\ No newline at end of file
@@ -1,30 +1,295 @@
 # app/store.py
 import sqlite3
 import json
+import asyncio
+import logging
+import queue
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import lru_cache
 from datetime import datetime
 from pathlib import Path
-from typing import Any, Optional
+from typing import Any, Literal, Optional
 
 from chatkit.store import Store, AttachmentStore, NotFoundError
 from chatkit.types import (
     ThreadMetadata, ThreadItem, Page, Attachment, 
     AttachmentCreateParams, ThreadItemBase
 )
-from pydantic import TypeAdapter
+import orjson
+from pydantic import BaseModel, TypeAdapter
 
+from .clients import client
 from .types import RequestContext
 
+logger = logging.getLogger(__name__)
+
 DB_PATH = "chatkit.db"
+READ_POOL_SIZE = 8
+ATTACHMENT_BATCH_WINDOW = 0.005  # seconds
+ATTACHMENT_BATCH_MAX = 256
+ANONYMOUS_MAX_THREADS = 1000
+
+# Building a TypeAdapter compiles the whole discriminated union; do it once, not per call
+_THREAD_ITEM_ADAPTER = TypeAdapter(ThreadItem)
+_ATTACHMENT_ADAPTER = TypeAdapter(Attachment)
+
+# Hot-path SQL kept as module constants; together with cached_statements on the connection
+# each statement is compiled once and reused from sqlite3's per-connection cache.
+_Q_LOAD_THREAD = "SELECT data FROM threads WHERE id = ? AND user_id = ?"
+# Upsert rather than INSERT OR REPLACE: with foreign_keys=ON the REPLACE's implicit
+# delete would cascade and wipe the thread's items on every title update.
+_Q_SAVE_THREAD = """
+    INSERT INTO threads (id, user_id, created_at, data) VALUES (?, ?, ?, ?)
+    ON CONFLICT(id) DO UPDATE SET
+        user_id = excluded.user_id, created_at = excluded.created_at, data = excluded.data
+"""
+_Q_THREAD_EXISTS = "SELECT 1 FROM threads WHERE id = ? AND user_id = ?"
+_Q_THREAD_CURSOR = "SELECT created_at, id FROM threads WHERE id = ? AND user_id = ?"
+_Q_DELETE_THREAD = "DELETE FROM threads WHERE id = ? AND user_id = ?"
+_Q_DELETE_THREAD_ITEMS = "DELETE FROM items WHERE thread_id = ? AND user_id = ?"
+_Q_ITEM_CURSOR = "SELECT created_at, id FROM items WHERE id = ? AND thread_id = ?"
+_Q_RECENT_ITEMS = """
+    SELECT data FROM (
+        SELECT data, created_at, id FROM items WHERE thread_id = ? ORDER BY created_at DESC, id DESC LIMIT ?
+    ) ORDER BY created_at, id
+"""
+_Q_INSERT_ITEM = "INSERT INTO items (id, thread_id, user_id, created_at, data) VALUES (?, ?, ?, ?, ?)"
+_Q_UPSERT_ITEM = "INSERT OR REPLACE INTO items (id, thread_id, user_id, created_at, data) VALUES (?, ?, ?, ?, ?)"
+_Q_LOAD_ITEM = "SELECT data FROM items WHERE id = ? AND thread_id = ?"
+_Q_DELETE_ITEM = "DELETE FROM items WHERE id = ? AND thread_id = ?"
+# Attachments are scoped to their uploader: an id from another user's message neither
+# loads nor deletes, and a colliding save cannot take over someone else's row.
+# A re-save keeps an openai_file_id the row already has: the Files API upload lands in the
+# background, possibly after ChatKit loaded the attachment it is about to save back.
+_Q_SAVE_ATTACHMENT = """
+    INSERT INTO attachments (id, user_id, data) VALUES (?, ?, ?)
+    ON CONFLICT(id) DO UPDATE SET data = CASE
+        WHEN json_extract(excluded.data, '$.metadata.openai_file_id') IS NULL
+            AND json_extract(attachments.data, '$.metadata.openai_file_id') IS NOT NULL
+        THEN json_set(excluded.data, '$.metadata.openai_file_id',
+                      json_extract(attachments.data, '$.metadata.openai_file_id'))
+        ELSE excluded.data
+    END
+    WHERE attachments.user_id = excluded.user_id
+"""
+_Q_LOAD_ATTACHMENT = "SELECT data FROM attachments WHERE id = ? AND user_id = ?"
+_Q_DELETE_ATTACHMENT = """
+    DELETE FROM attachments WHERE id = ? AND user_id = ?
+    RETURNING json_extract(data, '$.metadata.openai_file_id')
+"""
+_Q_DELETE_THREAD_ATTACHMENTS = """
+    DELETE FROM attachments WHERE json_extract(data, '$.thread_id') = ? AND user_id = ?
+    RETURNING json_extract(data, '$.metadata.openai_file_id')
+"""
+_Q_ATTACHMENT_EXISTS = "SELECT 1 FROM attachments WHERE id = ? AND user_id = ?"
+_Q_FIND_OPENAI_FILE = """
+    SELECT json_extract(data, '$.metadata.openai_file_id') FROM attachments
+    WHERE json_extract(data, '$.metadata.filename') = ?
+        AND json_extract(data, '$.metadata.openai_file_id') IS NOT NULL
+    LIMIT 1
+"""
+# One statement for any number of filenames (passed as a JSON array), so it stays cached
+_Q_FIND_OPENAI_FILES = """
+    SELECT json_extract(data, '$.metadata.filename'), json_extract(data, '$.metadata.openai_file_id')
+    FROM attachments
+    WHERE json_extract(data, '$.metadata.filename') IN (SELECT value FROM json_each(?))
+        AND json_extract(data, '$.metadata.openai_file_id') IS NOT NULL
+"""
+_Q_SET_OPENAI_FILE = """
+    UPDATE attachments SET data = json_set(data, '$.metadata.openai_file_id', ?)
+    WHERE id = ? AND user_id = ?
+"""
+_Q_OPENAI_FILE_IN_USE = "SELECT 1 FROM attachments WHERE json_extract(data, '$.metadata.openai_file_id') = ? LIMIT 1"
+
+
+def _dumps(model: BaseModel) -> str:
+    # model_dump + orjson beats model_dump_json for the large item payloads we write.
+    # Reads stay on validate_json, which is already as fast as orjson.loads + validate_python.
+    return orjson.dumps(model.model_dump(mode="json")).decode()
+
+
+@lru_cache(maxsize=None)
+def _page_query(table: str, scope_column: str, order: str, with_cursor: bool) -> str:
+    # Keyset pagination: rows strictly past the (created_at, id) of the `after` cursor.
+    # One extra row is fetched so has_more can be decided without a COUNT.
+    # Cached so each of the few variants is built once and hits the statement cache.
+    direction, op = ("DESC", "<") if order == "desc" else ("ASC", ">")
+    cursor_clause = f" AND (created_at, id) {op} (?, ?)" if with_cursor else ""
+    return (
+        f"SELECT data FROM {table} WHERE {scope_column} = ?{cursor_clause} "
+        f"ORDER BY created_at {direction}, id {direction} LIMIT ?"
+    )
+
+
+def _to_page(rows: list, limit: int, parse) -> Page:
+    has_more = len(rows) > limit
+    data = [parse(r[0]) for r in rows[:limit]]
+    new_after = data[-1].id if data and has_more else None
+    return Page(data=data, has_more=has_more, after=new_after)
+
+
+def _sort_key(row: ThreadMetadata | ThreadItem) -> tuple:
+    return (row.created_at, row.id)
+
+
+def _page_of(rows: list, after: str | None, limit: int, order: str) -> Page:
+    # In-memory counterpart of _page_query + _to_page, with the same cursor semantics
+    rows.sort(key=_sort_key, reverse=order == "desc")
+    start = 0
+    if after:
+        start = next((i + 1 for i, row in enumerate(rows) if row.id == after), 0)
+    window = rows[start:start + limit + 1]
+    has_more = len(window) > limit
+    data = window[:limit]
+    return Page(data=data, has_more=has_more, after=data[-1].id if data and has_more else None)
+
+
+class MemoryThreadStore:
+    """
+    Non-durable thread and item storage for anonymous users, bounded by evicting the
+    least recently used threads. Only touched from the event loop, so no locking.
+    """
+
+    def __init__(self, max_threads: int = ANONYMOUS_MAX_THREADS):
+        self._threads: OrderedDict[str, ThreadMetadata] = OrderedDict()
+        self._items: dict[str, dict[str, ThreadItem]] = {}
+        self._max_threads = max_threads
+
+    def _thread_items(self, thread_id: str) -> dict[str, ThreadItem]:
+        if thread_id not in self._threads:
+            raise NotFoundError(f"Thread {thread_id} not found")
+        self._threads.move_to_end(thread_id)
+        return self._items[thread_id]
+
+    async def load_thread(self, thread_id: str, context: RequestContext) -> ThreadMetadata:
+        self._thread_items(thread_id)
+        return self._threads[thread_id]
+
+    async def save_thread(self, thread: ThreadMetadata, context: RequestContext) -> None:
+        self._threads[thread.id] = thread
+        self._threads.move_to_end(thread.id)
+        self._items.setdefault(thread.id, {})
+        while len(self._threads) > self._max_threads:
+            evicted, _ = self._threads.popitem(last=False)
+            del self._items[evicted]
+
+    async def load_threads(self, limit: int, after: str | None, order: str, context: RequestContext) -> Page[ThreadMetadata]:
+        return _page_of(list(self._threads.values()), after, limit, order)
+
+    async def delete_thread(self, thread_id: str, context: RequestContext) -> None:
+        self._threads.pop(thread_id, None)
+        self._items.pop(thread_id, None)
+
+    async def load_thread_items(self, thread_id: str, after: str | None, limit: int, order: str, context: RequestContext) -> Page[ThreadItem]:
+        return _page_of(list(self._thread_items(thread_id).values()), after, limit, order)
+
+    async def load_recent_thread_items(self, thread_id: str, limit: int, context: RequestContext) -> list[ThreadItem]:
+        items = sorted(self._thread_items(thread_id).values(), key=_sort_key)
+        return items[max(len(items) - limit, 0):]
+
+    async def add_thread_item(self, thread_id: str, item: ThreadItem, context: RequestContext) -> None:
+        self._thread_items(thread_id)[item.id] = item
+
+    async def add_thread_items(self, thread_id: str, items: list[ThreadItem], context: RequestContext) -> None:
+        self._thread_items(thread_id).update((item.id, item) for item in items)
+
+    async def save_item(self, thread_id: str, item: ThreadItem, context: RequestContext) -> None:
+        self._thread_items(thread_id)[item.id] = item
+
+    async def load_item(self, thread_id: str, item_id: str, context: RequestContext) -> ThreadItem:
+        item = self._items.get(thread_id, {}).get(item_id)
+        if item is None:
+            raise NotFoundError(f"Item {item_id} not found")
+        return item
+
+    async def delete_thread_item(self, thread_id: str, item_id: str, context: RequestContext) -> None:
+        self._items.get(thread_id, {}).pop(item_id, None)
+
 
 class SQLiteStore(Store[RequestContext], AttachmentStore[RequestContext]):
-    def __init__(self):
+    def __init__(self, anonymous_in_memory: bool = False):
+        # Long-lived connections instead of a connect() per call: one writer behind a lock,
+        # plus a pool of read-only connections. WAL gives every reader its own snapshot,
+        # so thread listings and attachment lookups run in parallel with a commit.
+        self._write_conn = self._connect(DB_PATH)
+        self._write_conn.executescript("""
+            PRAGMA journal_mode=WAL;
+            PRAGMA synchronous=NORMAL;
+            PRAGMA wal_autocheckpoint=1000;
+            PRAGMA foreign_keys=ON;
+        """)
+        self._write_lock = threading.Lock()
         self._init_db()
 
-    def _get_conn(self):
-        return sqlite3.connect(DB_PATH)
+        self._read_pool: queue.SimpleQueue[sqlite3.Connection] = queue.SimpleQueue()
+        read_uri = f"{Path(DB_PATH).resolve().as_uri()}?mode=ro"
+        for _ in range(READ_POOL_SIZE):
+            self._read_pool.put(self._connect(read_uri, uri=True))
+
+        # Opt-in: anonymous threads and items kept in process memory instead of SQLite
+        # (attachments still go to SQLite). Only safe with a single worker process, since
+        # a follow-up request landing on another worker would not find the thread.
+        self._anonymous = MemoryThreadStore() if anonymous_in_memory else None
+
+        # Attachment group-commit writer, run by start()/close() from the app lifespan.
+        # The queue outlives a restarted writer, so queued rows are never orphaned.
+        self._attachment_queue: asyncio.Queue[tuple[tuple, asyncio.Future]] = asyncio.Queue()
+        self._attachment_writer: asyncio.Task | None = None
+
+    @staticmethod
+    def _connect(database: str, uri: bool = False) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            database, uri=uri, check_same_thread=False, isolation_level=None, cached_statements=256
+        )
+        conn.executescript("""
+            PRAGMA temp_store=MEMORY;
+            PRAGMA mmap_size=268435456;
+            PRAGMA cache_size=-65536;
+        """)
+        return conn
+
+    # Both are used from worker threads (see the asyncio.to_thread callers),
+    # so blocking on the lock or an empty pool never stalls the event loop.
+
+    @contextmanager
+    def _reader(self):
+        conn = self._read_pool.get()
+        try:
+            yield conn
+        finally:
+            self._read_pool.put(conn)
+
+    @contextmanager
+    def _writer(self):
+        with self._write_lock:
+            yield self._write_conn
+
+    def _exec_sync(self, sql: str, params: tuple = (), fetch: Literal["one", "all"] | None = None) -> Any:
+        # fetch=None marks a write and goes to the writer connection
+        if fetch is None:
+            with self._writer() as conn:
+                conn.execute(sql, params)
+            return None
+        with self._reader() as conn:
+            cursor = conn.execute(sql, params)
+            return cursor.fetchone() if fetch == "one" else cursor.fetchall()
+
+    @contextmanager
+    def _transaction(self):
+        # Groups multi-statement writes; single statements just autocommit via _exec_sync
+        with self._writer() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
 
     def _init_db(self):
-        with self._get_conn() as conn:
+        with self._transaction() as conn:
             conn.execute("""
                 CREATE TABLE IF NOT EXISTS threads (
                     id TEXT PRIMARY KEY,
@@ -43,6 +308,9 @@ class SQLiteStore(Store[RequestContext], AttachmentStore[RequestContext]):
                     FOREIGN KEY(thread_id) REFERENCES threads(id) ON DELETE CASCADE
                 )
             """)
+            # Keyset pagination walks these in (created_at, id) order, so a page reads only `limit` rows
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_threads_user_created ON threads(user_id, created_at, id)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_items_thread_created ON items(thread_id, created_at, id)")
             conn.execute("""
                 CREATE TABLE IF NOT EXISTS attachments (
                     id TEXT PRIMARY KEY,
@@ -50,133 +318,300 @@ class SQLiteStore(Store[RequestContext], AttachmentStore[RequestContext]):
                     data TEXT NOT NULL
                 )
             """)
+            # Files API uploads are shared by content (stored filename) and reference-counted
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_attachments_filename "
+                "ON attachments(json_extract(data, '$.metadata.filename'))"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_attachments_openai_file "
+                "ON attachments(json_extract(data, '$.metadata.openai_file_id'))"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_attachments_thread "
+                "ON attachments(json_extract(data, '$.thread_id'))"
+            )
+
+    def _is_anonymous(self, context: RequestContext) -> bool:
+        return self._anonymous is not None and context.anonymous
 
     # --- Thread Operations ---
 
     async def load_thread(self, thread_id: str, context: RequestContext) -> ThreadMetadata:
-        with self._get_conn() as conn:
-            row = conn.execute(
-                "SELECT data FROM threads WHERE id = ? AND user_id = ?", 
-                (thread_id, context.user_id)
-            ).fetchone()
-            if not row:
-                raise NotFoundError(f"Thread {thread_id} not found")
-            return ThreadMetadata.model_validate_json(row[0])
+        if self._is_anonymous(context):
+            return await self._anonymous.load_thread(thread_id, context)
+        row = await asyncio.to_thread(
+            self._exec_sync,
+            _Q_LOAD_THREAD,
+            (thread_id, context.user_id),
+            "one",
+        )
+        if not row:
+            raise NotFoundError(f"Thread {thread_id} not found")
+        return ThreadMetadata.model_validate_json(row[0])
 
     async def save_thread(self, thread: ThreadMetadata, context: RequestContext) -> None:
-        with self._get_conn() as conn:
-            conn.execute(
-                "INSERT OR REPLACE INTO threads (id, user_id, created_at, data) VALUES (?, ?, ?, ?)",
-                (thread.id, context.user_id, thread.created_at.isoformat(), thread.model_dump_json())
-            )
+        if self._is_anonymous(context):
+            return await self._anonymous.save_thread(thread, context)
+        await asyncio.to_thread(
+            self._exec_sync,
+            _Q_SAVE_THREAD,
+            (thread.id, context.user_id, thread.created_at.isoformat(), _dumps(thread))
+        )
 
     async def load_threads(self, limit: int, after: str | None, order: str, context: RequestContext) -> Page[ThreadMetadata]:
-        with self._get_conn() as conn:
-            # Simple pagination logic
-            query = "SELECT data FROM threads WHERE user_id = ? ORDER BY created_at DESC"
-            rows = conn.execute(query, (context.user_id,)).fetchall()
-            
-            threads = [ThreadMetadata.model_validate_json(r[0]) for r in rows]
-            
-            # Manual slice for demo purposes (SQL limit/offset is more efficient in prod)
-            start_idx = 0
+        if self._is_anonymous(context):
+            return await self._anonymous.load_threads(limit, after, order, context)
+        return await asyncio.to_thread(self._load_threads_sync, limit, after, order, context.user_id)
+
+    def _load_threads_sync(self, limit: int, after: str | None, order: str, user_id: str) -> Page[ThreadMetadata]:
+        with self._reader() as conn:
+            cursor = None
             if after:
-                for i, t in enumerate(threads):
-                    if t.id == after:
-                        start_idx = i + 1
-                        break
-            
-            sliced = threads[start_idx : start_idx + limit]
-            has_more = (start_idx + limit) < len(threads)
-            new_after = sliced[-1].id if sliced and has_more else None
-            
-            return Page(data=sliced, has_more=has_more, after=new_after)
+                cursor = conn.execute(_Q_THREAD_CURSOR, (after, user_id)).fetchone()
+            rows = conn.execute(
+                _page_query("threads", "user_id", order, cursor is not None),
+                (user_id, *(cursor or ()), limit + 1),
+            ).fetchall()
+        return _to_page(rows, limit, ThreadMetadata.model_validate_json)
 
     async def delete_thread(self, thread_id: str, context: RequestContext) -> None:
-        with self._get_conn() as conn:
-            conn.execute("DELETE FROM threads WHERE id = ? AND user_id = ?", (thread_id, context.user_id))
-            conn.execute("DELETE FROM items WHERE thread_id = ? AND user_id = ?", (thread_id, context.user_id))
+        # The thread's attachments go with it, along with Files API uploads nothing else uses
+        if self._is_anonymous(context):
+            await self._anonymous.delete_thread(thread_id, context)
+            unused = await asyncio.to_thread(self._delete_thread_attachments_sync, thread_id, context.user_id)
+        else:
+            unused = await asyncio.to_thread(self._delete_thread_sync, thread_id, context.user_id)
+        await self.delete_openai_files(unused)
+
+    def _delete_thread_sync(self, thread_id: str, user_id: str) -> list[str]:
+        with self._transaction() as conn:
+            conn.execute(_Q_DELETE_THREAD, (thread_id, user_id))
+            conn.execute(_Q_DELETE_THREAD_ITEMS, (thread_id, user_id))
+            return self._delete_attachments(conn, _Q_DELETE_THREAD_ATTACHMENTS, (thread_id, user_id))
+
+    def _delete_thread_attachments_sync(self, thread_id: str, user_id: str) -> list[str]:
+        with self._transaction() as conn:
+            return self._delete_attachments(conn, _Q_DELETE_THREAD_ATTACHMENTS, (thread_id, user_id))
 
     # --- Item Operations ---
 
     async def load_thread_items(self, thread_id: str, after: str | None, limit: int, order: str, context: RequestContext) -> Page[ThreadItem]:
-        with self._get_conn() as conn:
+        if self._is_anonymous(context):
+            return await self._anonymous.load_thread_items(thread_id, after, limit, order, context)
+        # Validation happens inside the worker thread too; long histories are CPU-heavy to parse
+        return await asyncio.to_thread(self._load_thread_items_sync, thread_id, after, limit, order, context.user_id)
+
+    def _load_thread_items_sync(self, thread_id: str, after: str | None, limit: int, order: str, user_id: str) -> Page[ThreadItem]:
+        with self._reader() as conn:
             # Basic validation that thread belongs to user
-            thread_row = conn.execute("SELECT 1 FROM threads WHERE id = ? AND user_id = ?", (thread_id, context.user_id)).fetchone()
+            thread_row = conn.execute(_Q_THREAD_EXISTS, (thread_id, user_id)).fetchone()
             if not thread_row:
                 raise NotFoundError("Thread not found")
 
-            # Get all items, verify types using TypeAdapter
+            cursor = None
+            if after:
+                cursor = conn.execute(_Q_ITEM_CURSOR, (after, thread_id)).fetchone()
             rows = conn.execute(
-                "SELECT data, created_at FROM items WHERE thread_id = ? ORDER BY created_at ASC", 
-                (thread_id,)
+                _page_query("items", "thread_id", order, cursor is not None),
+                (thread_id, *(cursor or ()), limit + 1),
             ).fetchall()
-            
-            # Parse all to sort/filter
-            adapter = TypeAdapter(ThreadItem)
-            items = [adapter.validate_json(r[0]) for r in rows]
-            
-            if order == "desc":
-                items.reverse()
-
-            start_idx = 0
-            if after:
-                for i, item in enumerate(items):
-                    if item.id == after:
-                        start_idx = i + 1
-                        break
-            
-            sliced = items[start_idx : start_idx + limit]
-            has_more = (start_idx + limit) < len(items)
-            new_after = sliced[-1].id if sliced and has_more else None
+        return _to_page(rows, limit, _THREAD_ITEM_ADAPTER.validate_json)
 
-            return Page(data=sliced, has_more=has_more, after=new_after)
+    async def load_recent_thread_items(self, thread_id: str, limit: int, context: RequestContext) -> list[ThreadItem]:
+        if self._is_anonymous(context):
+            return await self._anonymous.load_recent_thread_items(thread_id, limit, context)
+        # The newest `limit` items in chronological order, ordered by SQLite rather than reversed in Python
+        return await asyncio.to_thread(self._load_recent_thread_items_sync, thread_id, limit, context.user_id)
+
+    def _load_recent_thread_items_sync(self, thread_id: str, limit: int, user_id: str) -> list[ThreadItem]:
+        with self._reader() as conn:
+            if not conn.execute(_Q_THREAD_EXISTS, (thread_id, user_id)).fetchone():
+                raise NotFoundError("Thread not found")
+            rows = conn.execute(_Q_RECENT_ITEMS, (thread_id, limit)).fetchall()
+        return [_THREAD_ITEM_ADAPTER.validate_json(r[0]) for r in rows]
 
     async def add_thread_item(self, thread_id: str, item: ThreadItem, context: RequestContext) -> None:
-        with self._get_conn() as conn:
-            conn.execute(
-                "INSERT INTO items (id, thread_id, user_id, created_at, data) VALUES (?, ?, ?, ?, ?)",
-                (item.id, thread_id, context.user_id, item.created_at.isoformat(), item.model_dump_json())
-            )
+        if self._is_anonymous(context):
+            return await self._anonymous.add_thread_item(thread_id, item, context)
+        await asyncio.to_thread(
+            self._exec_sync,
+            _Q_INSERT_ITEM,
+            (item.id, thread_id, context.user_id, item.created_at.isoformat(), _dumps(item))
+        )
+
+    async def add_thread_items(self, thread_id: str, items: list[ThreadItem], context: RequestContext) -> None:
+        if self._is_anonymous(context):
+            return await self._anonymous.add_thread_items(thread_id, items, context)
+        # Bulk variant of add_thread_item: one transaction (one commit) for the whole batch
+        rows = [
+            (item.id, thread_id, context.user_id, item.created_at.isoformat(), _dumps(item))
+            for item in items
+        ]
+        await asyncio.to_thread(self._add_thread_items_sync, rows)
+
+    def _add_thread_items_sync(self, rows: list[tuple]) -> None:
+        with self._transaction() as conn:
+            conn.executemany(_Q_INSERT_ITEM, rows)
 
     async def save_item(self, thread_id: str, item: ThreadItem, context: RequestContext) -> None:
+        if self._is_anonymous(context):
+            return await self._anonymous.save_item(thread_id, item, context)
         # Same as add for this simple implementation, essentially an upsert
-        with self._get_conn() as conn:
-            conn.execute(
-                "INSERT OR REPLACE INTO items (id, thread_id, user_id, created_at, data) VALUES (?, ?, ?, ?, ?)",
-                (item.id, thread_id, context.user_id, item.created_at.isoformat(), item.model_dump_json())
-            )
+        await asyncio.to_thread(
+            self._exec_sync,
+            _Q_UPSERT_ITEM,
+            (item.id, thread_id, context.user_id, item.created_at.isoformat(), _dumps(item))
+        )
 
     async def load_item(self, thread_id: str, item_id: str, context: RequestContext) -> ThreadItem:
-        with self._get_conn() as conn:
-            row = conn.execute("SELECT data FROM items WHERE id = ? AND thread_id = ?", (item_id, thread_id)).fetchone()
-            if not row:
-                raise NotFoundError(f"Item {item_id} not found")
-            return TypeAdapter(ThreadItem).validate_json(row[0])
+        if self._is_anonymous(context):
+            return await self._anonymous.load_item(thread_id, item_id, context)
+        row = await asyncio.to_thread(
+            self._exec_sync, _Q_LOAD_ITEM, (item_id, thread_id), "one"
+        )
+        if not row:
+            raise NotFoundError(f"Item {item_id} not found")
+        return _THREAD_ITEM_ADAPTER.validate_json(row[0])
 
     async def delete_thread_item(self, thread_id: str, item_id: str, context: RequestContext) -> None:
-        with self._get_conn() as conn:
-            conn.execute("DELETE FROM items WHERE id = ? AND thread_id = ?", (item_id, thread_id))
+        if self._is_anonymous(context):
+            return await self._anonymous.delete_thread_item(thread_id, item_id, context)
+        await asyncio.to_thread(self._exec_sync, _Q_DELETE_ITEM, (item_id, thread_id))
 
     # --- Attachment Operations ---
 
+    def start(self) -> None:
+        """Starts the attachment group-commit writer; called from the app lifespan."""
+        if self._attachment_writer is None or self._attachment_writer.done():
+            self._attachment_writer = asyncio.create_task(self._write_attachments())
+
+    async def close(self) -> None:
+        """Stops the writer; saves still queued or in flight fail instead of hanging."""
+        if self._attachment_writer is not None:
+            self._attachment_writer.cancel()
+            try:
+                await self._attachment_writer
+            except asyncio.CancelledError:
+                pass
+
     async def save_attachment(self, attachment: Attachment, context: RequestContext) -> None:
-        with self._get_conn() as conn:
-            conn.execute(
-                "INSERT OR REPLACE INTO attachments (id, user_id, data) VALUES (?, ?, ?)",
-                (attachment.id, context.user_id, attachment.model_dump_json())
-            )
+        # Group commit: concurrent uploads share one transaction (one WAL fsync) instead of
+        # committing one by one. Returns once the batch holding this row has committed.
+        if self._attachment_writer is None or self._attachment_writer.done():
+            raise RuntimeError("Attachment writer is not running; call SQLiteStore.start()")
+        future = asyncio.get_running_loop().create_future()
+        self._attachment_queue.put_nowait(((attachment.id, context.user_id, _dumps(attachment)), future))
+        await future
+
+    async def _write_attachments(self) -> None:
+        queue_ = self._attachment_queue
+        batch: list[tuple[tuple, asyncio.Future]] = []
+        try:
+            while True:
+                batch = [await queue_.get()]
+                # Debounce so a burst of uploads lands in the same batch
+                await asyncio.sleep(ATTACHMENT_BATCH_WINDOW)
+                while len(batch) < ATTACHMENT_BATCH_MAX and not queue_.empty():
+                    batch.append(queue_.get_nowait())
+                try:
+                    await asyncio.to_thread(self._save_attachments_sync, [row for row, _ in batch])
+                except Exception as exc:
+                    for _, future in batch:
+                        if not future.done():
+                            future.set_exception(exc)
+                else:
+                    for _, future in batch:
+                        if not future.done():
+                            future.set_result(None)
+                batch = []
+        finally:
+            # Whatever ends the writer, nobody may be left awaiting a row it will never write
+            while not queue_.empty():
+                batch.append(queue_.get_nowait())
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(RuntimeError("Attachment writer stopped"))
+
+    def _save_attachments_sync(self, rows: list[tuple]) -> None:
+        with self._transaction() as conn:
+            conn.executemany(_Q_SAVE_ATTACHMENT, rows)
 
     async def load_attachment(self, attachment_id: str, context: RequestContext) -> Attachment:
-        with self._get_conn() as conn:
-            row = conn.execute("SELECT data FROM attachments WHERE id = ?", (attachment_id,)).fetchone()
-            if not row:
-                raise NotFoundError(f"Attachment {attachment_id} not found")
-            return TypeAdapter(Attachment).validate_json(row[0])
+        row = await asyncio.to_thread(
+            self._exec_sync, _Q_LOAD_ATTACHMENT, (attachment_id, context.user_id), "one"
+        )
+        if not row:
+            raise NotFoundError(f"Attachment {attachment_id} not found")
+        return _ATTACHMENT_ADAPTER.validate_json(row[0])
 
     async def delete_attachment(self, attachment_id: str, context: RequestContext) -> None:
-        with self._get_conn() as conn:
-            conn.execute("DELETE FROM attachments WHERE id = ?", (attachment_id,))
+        unused = await asyncio.to_thread(self._delete_attachment_sync, attachment_id, context.user_id)
+        await self.delete_openai_files(unused)
+
+    def _delete_attachment_sync(self, attachment_id: str, user_id: str) -> list[str]:
+        with self._transaction() as conn:
+            return self._delete_attachments(conn, _Q_DELETE_ATTACHMENT, (attachment_id, user_id))
+
+    @staticmethod
+    def _delete_attachments(conn: sqlite3.Connection, sql: str, params: tuple) -> list[str]:
+        """
+        Runs an attachment DELETE ... RETURNING and, in the same transaction, picks out
+        the Files API ids no remaining attachment references. Once that commits nothing
+        can link them again, so the caller may delete them remotely.
+        """
+        file_ids = {row[0] for row in conn.execute(sql, params).fetchall() if row[0]}
+        return [
+            file_id for file_id in file_ids
+            if conn.execute(_Q_OPENAI_FILE_IN_USE, (file_id,)).fetchone() is None
+        ]
+
+    # --- Files API uploads (images are sent to the model by file id) ---
+
+    async def find_openai_file_ids(self, filenames: list[str]) -> dict[str, str]:
+        """Maps stored filenames to the Files API ids already uploaded for them."""
+        if not filenames:
+            return {}
+        rows = await asyncio.to_thread(
+            self._exec_sync, _Q_FIND_OPENAI_FILES, (orjson.dumps(filenames).decode(),), "all"
+        )
+        return dict(rows)
+
+    async def reuse_openai_file(self, attachment_id: str, filename: str, context: RequestContext) -> bool:
+        """
+        Links the attachment to an existing upload of the same stored file. False means
+        it still needs its own upload; True that it is linked or has been deleted.
+        """
+        return await asyncio.to_thread(self._reuse_openai_file_sync, attachment_id, filename, context.user_id)
+
+    def _reuse_openai_file_sync(self, attachment_id: str, filename: str, user_id: str) -> bool:
+        # Find and link in one writer transaction, so a concurrent delete cannot
+        # release the file in between
+        with self._transaction() as conn:
+            row = conn.execute(_Q_FIND_OPENAI_FILE, (filename,)).fetchone()
+            if row is None:
+                return conn.execute(_Q_ATTACHMENT_EXISTS, (attachment_id, user_id)).fetchone() is None
+            conn.execute(_Q_SET_OPENAI_FILE, (row[0], attachment_id, user_id))
+            return True
+
+    async def set_openai_file_id(self, attachment_id: str, openai_file_id: str, context: RequestContext) -> bool:
+        """Records the Files API id on an attachment; False if the attachment is gone."""
+        return await asyncio.to_thread(
+            self._set_openai_file_id_sync, attachment_id, openai_file_id, context.user_id
+        )
+
+    def _set_openai_file_id_sync(self, attachment_id: str, openai_file_id: str, user_id: str) -> bool:
+        with self._writer() as conn:
+            return conn.execute(_Q_SET_OPENAI_FILE, (openai_file_id, attachment_id, user_id)).rowcount > 0
+
+    async def delete_openai_files(self, openai_file_ids: list[str]) -> None:
+        """Deletes Files API uploads that are no longer referenced."""
+        results = await asyncio.gather(
+            *(client.files.delete(file_id) for file_id in openai_file_ids), return_exceptions=True
+        )
+        for result in results:
+            if isinstance(result, Exception):
+                logger.error("Vision file cleanup error", exc_info=result)
     
     # Required by abstract base class, but unused in Direct upload strategy
     # The server manually saves the attachment in main.py
@@ -2,6 +2,7 @@ from typing import Literal, List
 import random
 import asyncio
 from datetime import datetime
+from async_lru import alru_cache
 from pydantic import BaseModel, Field
 from agents import function_tool, RunContextWrapper
 from chatkit.agents import AgentContext
@@ -97,15 +98,24 @@ async def preview_theme(
     return "Theme proposal displayed."
 
 
+@alru_cache(maxsize=256, ttl=300)
+async def _get_weather_impl(location: str) -> dict:
+    """
+    Weather lookup, cached per location for 5 minutes so repeated tool calls
+    don't repeat the API call. Kept separate from the tool so the widget still streams every time.
+    """
+    # Realistically you'd call a weather API here
+    return {
+        "temperature": "72",
+        "condition_desc": "Sunny sky and warm temperatures are expected for the rest of the afternoon.",
+    }
+
+
 @function_tool
 async def get_weather(ctx: RunContextWrapper[AgentContext], location: str):
     """Get the current weather with a vibrant UI card."""
-    # Realistically you'd call a weather API here
-    widget = build_vibrant_weather_widget(
-        location=location,
-        temperature="72",
-        condition_desc="Sunny sky and warm temperatures are expected for the rest of the afternoon.",
-    )
+    weather = await _get_weather_impl(location)
+    widget = build_vibrant_weather_widget(location=location, **weather)
     await ctx.context.stream_widget(widget)
     return f"Showed weather card for {location}."
 
@@ -1,6 +1,12 @@
 # app/types.py
+import sys
 from dataclasses import dataclass
 
-@dataclass
+# User id for requests without an X-ChatKit-User header
+ANONYMOUS_USER_ID = sys.intern("anonymous-default")
+
+@dataclass(frozen=True, slots=True)
 class RequestContext:
-    user_id: str
\ No newline at end of file
+    user_id: str
+    # Set by get_user when the request carried no user header
+    anonymous: bool = False
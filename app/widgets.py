@@ -15,6 +15,31 @@ from chatkit.widgets import (
     LineSeries,  # Import Chart components
 )
 
+# Invariant pieces are built (and validated) once at import. Pydantic doesn't revalidate
+# model instances passed as children, so each build only pays for the data-dependent nodes.
+_SALES_SUBTITLE = Text(value="Revenue vs. Net Profit (YTD)", size="sm", color="secondary")
+_SALES_SERIES = [
+    BarSeries(
+        dataKey="revenue", 
+        label="Revenue", 
+        color="blue" # ChatKit color token
+    ),
+    LineSeries(
+        dataKey="profit", 
+        label="Net Profit", 
+        color="green", 
+        curveType="monotone" # Smooth lines
+    )
+]
+_SALES_DIVIDER = Divider(spacing=4)
+_SUNNY_ICON = Image(
+    src="https://cdn.openai.com/API/storybook/mostly-sunny.png",
+    size=80,
+)
+_SPACER_12 = Spacer(minSize=12)
+_SPACER_8 = Spacer(minSize=8)
+
+
 def build_sales_dashboard(data: list, region: str):
     """
     Builds a Chart widget visualizing Revenue vs Profit.
@@ -24,8 +49,8 @@ def build_sales_dashboard(data: list, region: str):
         size="lg",
         children=[
             Title(value=f"{region} Sales Performance", size="md"),
-            Text(value="Revenue vs. Net Profit (YTD)", size="sm", color="secondary"),
-            Spacer(minSize=12),
+            _SALES_SUBTITLE,
+            _SPACER_12,
             Chart(
                 type="Chart",
                 data=data,
@@ -33,23 +58,11 @@ def build_sales_dashboard(data: list, region: str):
                 # X-Axis Configuration
                 xAxis={"dataKey": "month"}, 
                 # Data Series Configuration
-                series=[
-                    BarSeries(
-                        dataKey="revenue", 
-                        label="Revenue", 
-                        color="blue" # ChatKit color token
-                    ),
-                    LineSeries(
-                        dataKey="profit", 
-                        label="Net Profit", 
-                        color="green", 
-                        curveType="monotone" # Smooth lines
-                    )
-                ],
+                series=_SALES_SERIES,
                 showTooltip=True,
                 showLegend=True
             ),
-            Divider(spacing=4),
+            _SALES_DIVIDER,
             Row(
                 justify="end",
                 children=[
@@ -80,10 +93,7 @@ def build_vibrant_weather_widget(location: str, temperature: str, condition_desc
                         align="center",
                         gap=2,
                         children=[
-                            Image(
-                                src="https://cdn.openai.com/API/storybook/mostly-sunny.png",
-                                size=80,
-                            ),
+                            _SUNNY_ICON,
                             Title(
                                 value=f"{temperature}°",
                                 size="5xl",
@@ -130,9 +140,9 @@ def build_clean_theme_widget(reasoning: str, theme_data: dict):
                     ),
                 ],
             ),
-            Spacer(minSize=12),  # Added margin
+            _SPACER_12,  # Added margin
             Text(value=reasoning, size="sm", color="secondary"),
-            Spacer(minSize=8),
+            _SPACER_8,
             Button(
                 label="Apply Theme",
                 block=True,
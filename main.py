@@ -1,45 +1,143 @@
 import os
-import shutil
-import base64
+import asyncio
+import hashlib
+import logging
+import logging.handlers
+import queue
+import secrets
+import time
+import pybase64 as base64
+from contextlib import asynccontextmanager
+from functools import lru_cache
 from pathlib import Path
-from uuid import uuid4
 
-from fastapi import FastAPI, Request, UploadFile, Depends, Response
-from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi import FastAPI, Request, UploadFile, Depends, Response, BackgroundTasks
+from fastapi.responses import StreamingResponse, ORJSONResponse, FileResponse
 from fastapi.staticfiles import StaticFiles
+from starlette.datastructures import Headers
+from starlette.staticfiles import NotModifiedResponse
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
 
 from chatkit.server import StreamingResult
 from chatkit.types import FileAttachment, ImageAttachment
 
-from app.server import MyChatKitServer
+from app.clients import client
+from app.server import MyChatKitServer, is_image
 from app.store import SQLiteStore
-from app.types import RequestContext
+from app.types import ANONYMOUS_USER_ID, RequestContext
 
 load_dotenv()
 
-app = FastAPI()
+logger = logging.getLogger(__name__)
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    Enqueues the record as is. The stock prepare() formats the message and any
+    traceback on the calling thread; here the listener's handler does that instead.
+    Records only cross threads within this process, so they don't need flattening.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Log records are only enqueued on the request path; a background thread
+    # formats them and does the blocking stderr write.
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    queue_handler = DeferredQueueHandler(log_queue)
+    listener = logging.handlers.QueueListener(log_queue, logging.StreamHandler())
+    root = logging.getLogger()
+    root.addHandler(queue_handler)
+    listener.start()
+    store.start()
+    try:
+        yield
+    finally:
+        await store.close()
+        # Release the shared OpenAI connection pool
+        await client.close()
+        listener.stop()
+        root.removeHandler(queue_handler)
+
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 
 # --- Enable CORS ---
+# Explicit allow-list instead of "*": with allow_credentials Starlette echoes any request
+# origin back, so every site could make credentialed calls. The default covers the bundled
+# UI, a separate dev frontend, and the ChatKit frame (served from the CDN) that may send
+# the uploads itself.
+DEFAULT_CORS_ORIGINS = "http://localhost:8000,http://localhost:3000,https://cdn.platform.openai.com"
+CORS_ORIGINS = [
+    origin.strip()
+    for origin in os.environ.get("CORS_ORIGINS", DEFAULT_CORS_ORIGINS).split(",")
+    if origin.strip()
+]
+PREFLIGHT_CACHE_SIZE = 1024
+
+class PreflightCachingCORSMiddleware(CORSMiddleware):
+    """
+    Reuses the preflight response for a repeated (origin, method, headers) triple
+    instead of rebuilding its headers on every OPTIONS request.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._preflight_cache: dict[tuple, Response] = {}
+
+    def preflight_response(self, request_headers):
+        key = (
+            request_headers.get("origin"),
+            request_headers.get("access-control-request-method"),
+            request_headers.get("access-control-request-headers"),
+        )
+        response = self._preflight_cache.get(key)
+        if response is None:
+            response = super().preflight_response(request_headers)
+            # Bounded: the requested headers are client-controlled
+            if len(self._preflight_cache) < PREFLIGHT_CACHE_SIZE:
+                self._preflight_cache[key] = response
+        return response
+
 app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
+    PreflightCachingCORSMiddleware,
+    allow_origins=CORS_ORIGINS,
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
 )
 
 UPLOAD_DIR = Path("uploads")
+# Public origin the browser reaches /files through (differs from localhost in production)
+BASE_FILES_URL = os.environ.get("PUBLIC_BASE_URL", "http://localhost:8000").rstrip("/") + "/files/"
 UPLOAD_DIR.mkdir(exist_ok=True)
-store = SQLiteStore()
+# Larger images are previewed from /files instead of adding a data URL 4/3 their size
+# to the response. Only when /files is https: the bundled UI is loaded from an https
+# CDN, so an http preview URL is blocked as mixed content and must stay inline.
+MAX_INLINE_PREVIEW_BYTES = 64 * 1024 if BASE_FILES_URL.startswith("https://") else None
+# ~1 MiB reads; a multiple of 3 so per-chunk base64 output concatenates without padding
+UPLOAD_CHUNK_SIZE = 3 * (1024 * 1024 // 3)
+# Keep anonymous (header-less) threads in memory instead of SQLite. Per-process state,
+# so the server runs a single worker when this is on.
+ANONYMOUS_IN_MEMORY = bool(os.environ.get("ANONYMOUS_IN_MEMORY"))
+store = SQLiteStore(anonymous_in_memory=ANONYMOUS_IN_MEMORY)
 server = MyChatKitServer(store=store, attachment_store=store)
 
+@lru_cache(maxsize=4096)
+def _ctx(user_id: str) -> RequestContext:
+    # Contexts are immutable, so every request from the same user can share one
+    return RequestContext(user_id=user_id)
+
+_ANONYMOUS_CTX = RequestContext(user_id=ANONYMOUS_USER_ID, anonymous=True)
+
 def get_user(request: Request) -> RequestContext:
-    user_id = request.headers.get("x-chatkit-user")
+    # Direct uploads are posted by the ChatKit frame itself, without the custom fetch
+    # that adds the header, so the UI passes the same id in uploadUrl's query string.
+    user_id = request.headers.get("x-chatkit-user") or request.query_params.get("user")
     if not user_id:
-        user_id = "anonymous-default"
-    return RequestContext(user_id=user_id)
+        return _ANONYMOUS_CTX
+    return _ctx(user_id)
 
 @app.post("/chatkit")
 async def handle_chatkit(request: Request, ctx: RequestContext = Depends(get_user)):
@@ -53,37 +151,116 @@ async def handle_chatkit(request: Request, ctx: RequestContext = Depends(get_use
             return Response(content=result.json, media_type="application/json")
             
     except Exception as e:
-        print(f"Error processing request: {e}")
-        return JSONResponse(status_code=500, content={"error": str(e)})
+        logger.exception("Error processing request")
+        return ORJSONResponse(status_code=500, content={"error": str(e)})
+
+def new_file_id() -> str:
+    # Time prefix so attachment rows append to the end of the primary-key B-tree; the
+    # random suffix keeps ids unguessable and unique across workers
+    return f"file_{time.time_ns():x}{secrets.token_hex(8)}"
+
+def _inline_preview(size: int) -> bool:
+    return MAX_INLINE_PREVIEW_BYTES is None or size < MAX_INLINE_PREVIEW_BYTES
+
+def ingest_upload(src, ext: str, image: bool) -> tuple[str, str | None]:
+    """
+    Streams an upload to disk in a single pass, hashing each chunk (and for images,
+    base64-encoding it for the preview) while it is still in cache.
+    The file is then moved to its content-hash name, or dropped if that already exists.
+    Returns (stored filename, base64 preview if the image is inlined).
+    """
+    hasher = hashlib.sha256()
+    b64_parts: list[bytes] = []
+    size = 0
+    tmp_path = UPLOAD_DIR / f"{new_file_id()}.part"
+    try:
+        with open(tmp_path, "wb") as f:
+            while chunk := src.read(UPLOAD_CHUNK_SIZE):
+                f.write(chunk)
+                hasher.update(chunk)
+                size += len(chunk)
+                if image and _inline_preview(size):
+                    b64_parts.append(base64.b64encode(chunk))
+        safe_filename = f"file_{hasher.hexdigest()[:32]}{ext}"
+        final_path = UPLOAD_DIR / safe_filename
+        if final_path.exists():
+            tmp_path.unlink()
+        else:
+            os.replace(tmp_path, final_path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+    if image and _inline_preview(size):
+        return safe_filename, b"".join(b64_parts).decode("ascii")
+    return safe_filename, None
+
+async def upload_to_openai(filename: str, file_path: Path, content_type: str) -> str | None:
+    """
+    Uploads an image once to the OpenAI Files API so later turns can reference it
+    by file id instead of re-sending it as base64. Returns None if the upload fails;
+    the converter then falls back to a data URL.
+    """
+    try:
+        file_bytes = await asyncio.to_thread(file_path.read_bytes)
+        uploaded = await client.files.create(
+            file=(filename, file_bytes, content_type), purpose="vision"
+        )
+        return uploaded.id
+    except Exception:
+        logger.exception("Vision upload error")
+        return None
+
+async def attach_openai_file(attachment: ImageAttachment, ctx: RequestContext) -> None:
+    """
+    Runs after the /upload response is sent. Identical images (same stored file) reuse
+    one Files API upload; until this finishes the converter sends a data URL instead.
+    """
+    safe_filename = attachment.metadata["filename"]
+    if await store.reuse_openai_file(attachment.id, safe_filename, ctx):
+        return
+    openai_file_id = await upload_to_openai(
+        attachment.name, UPLOAD_DIR / safe_filename, attachment.mime_type
+    )
+    if openai_file_id is None:
+        return
+    if not await store.set_openai_file_id(attachment.id, openai_file_id, ctx):
+        # Deleted while uploading: don't leave an unreferenced file behind
+        await store.delete_openai_files([openai_file_id])
 
 @app.post("/upload")
-async def upload_file(file: UploadFile, ctx: RequestContext = Depends(get_user)):
-    file_id = f"file_{uuid4().hex}"
+async def upload_file(
+    file: UploadFile, background_tasks: BackgroundTasks, ctx: RequestContext = Depends(get_user)
+):
+    file_id = new_file_id()
     ext = Path(file.filename).suffix
-    safe_filename = f"{file_id}{ext}"
-    file_path = UPLOAD_DIR / safe_filename
-    
-    # 1. Save the file locally for the Agent to use
-    with open(file_path, "wb") as f:
-        shutil.copyfileobj(file.file, f)
-        
-    is_image = file.content_type.startswith("image/")
-    
-    # 2. --- Generate Base64 for the Preview ---
-    # This avoids the "Mixed Content" block in the browser UI
-    if is_image:
-        with open(file_path, "rb") as f:
-            file_bytes = f.read()
-            b64_data = base64.b64encode(file_bytes).decode("utf-8")
-            preview_data_url = f"data:{file.content_type};base64,{b64_data}"
-            
+    image = is_image(file.content_type)
+
+    # Write, hash and (for images) preview-encode in one pass, off the event loop.
+    # Identical uploads share one stored file.
+    safe_filename, b64_data = await asyncio.to_thread(
+        ingest_upload, file.file, ext, image
+    )
+    file_url = BASE_FILES_URL + safe_filename
+    metadata = {"filename": safe_filename}
+
+    if image:
+        # --- Preview ---
+        # An inline data URL avoids the "Mixed Content" block in the browser UI; see
+        # MAX_INLINE_PREVIEW_BYTES for when large images link to /files instead.
+        if b64_data is not None:
+            preview_url = f"data:{file.content_type};base64,{b64_data}"
+        else:
+            preview_url = file_url
+
         attachment = ImageAttachment(
             type="image", 
             id=file_id, 
             name=file.filename,
             mime_type=file.content_type, 
-            preview_url=preview_data_url, # Use the Data URL here
-            url=f"http://localhost:8000/files/{safe_filename}"
+            preview_url=preview_url,
+            url=file_url,
+            metadata=metadata,
         )
     else:
         attachment = FileAttachment(
@@ -91,15 +268,54 @@ async def upload_file(file: UploadFile, ctx: RequestContext = Depends(get_user))
             id=file_id, 
             name=file.filename,
             mime_type=file.content_type, 
-            url=f"http://localhost:8000/files/{safe_filename}"
+            url=file_url,
+            metadata=metadata,
         )
         
     await store.save_attachment(attachment, ctx)
-    return attachment.model_dump(mode="json")
+    if image:
+        # Files API upload off the request path, once the row it updates exists
+        background_tasks.add_task(attach_openai_file, attachment, ctx)
+    # metadata (the stored filename) is server-side only
+    # Serialize straight to JSON bytes instead of dumping a dict for FastAPI to re-encode
+    return Response(
+        content=attachment.model_dump_json(context={"exclude_metadata": True}),
+        media_type="application/json",
+    )
+
+class UploadedFiles(StaticFiles):
+    """
+    Serves uploads as immutable: a stored file is never rewritten under the same
+    name, so browsers may cache it for a year and revalidate against the name alone.
+    """
 
-app.mount("/files", StaticFiles(directory=UPLOAD_DIR), name="files")
+    def file_response(self, full_path, stat_result, scope, status_code: int = 200):
+        headers = {
+            "cache-control": "public, max-age=31536000, immutable",
+            "etag": f'"{Path(full_path).stem}"',
+        }
+        if_none_match = Headers(scope=scope).get("if-none-match")
+        if if_none_match:
+            tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+            if headers["etag"] in tags or "*" in tags:
+                return NotModifiedResponse(Headers(headers))
+        return FileResponse(full_path, status_code=status_code, headers=headers, stat_result=stat_result)
+
+app.mount("/files", UploadedFiles(directory=UPLOAD_DIR), name="files")
 app.mount("/", StaticFiles(directory="static", html=True), name="static")
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
+    if os.environ.get("DEV"):
+        uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
+    else:
+        # loop/http "auto" resolve to uvloop and httptools (installed by uvicorn[standard])
+        uvicorn.run(
+            "main:app",
+            host="0.0.0.0",
+            port=8000,
+            workers=1 if ANONYMOUS_IN_MEMORY else os.cpu_count(),
+            loop="auto",
+            http="auto",
+            access_log=False,
+        )
\ No newline at end of file